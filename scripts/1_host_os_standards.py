@@ -25,16 +25,30 @@ Ubuntu LTS / Debian Stable
 """
 
 import os
+import atexit
+import re
 import sys
+import mmap
+import time
+import functools
 import subprocess
 from pathlib import Path
 from datetime import datetime
 
+try:
+    import dbus  # Optional: talk to systemd without forking systemctl
+except ImportError:
+    dbus = None
+
 # ---------------- CONFIG ----------------
 DOCKER_USER = "doc_user"
 DOCKER_GROUP = "doc_group"
 DOCKER_REMAP_USER = "dockremap"  # Standard user for userns-remap
 ALLOWED_PORTS = ["22", "80", "443"]
+PACKAGES = ["ufw", "fail2ban", "unattended-upgrades", "rsyslog", "logrotate"]
+APT_PKGCACHE = "/var/cache/apt/pkgcache.bin"
+APT_CACHE_MAX_AGE = 3600  # seconds before package lists are refreshed
+DPKG_STATUS = "/var/lib/dpkg/status"
 
 REPORT_FILE = "/var/log/docker-host-compliance.txt"
 MODE = "--apply" if len(sys.argv) == 1 else sys.argv[1]
@@ -44,25 +58,103 @@ def is_root():
     return os.geteuid() == 0
 
 def run(cmd):
+    """Runs a shell string, or an argv list directly without a shell."""
+    shell = isinstance(cmd, str)
     if MODE == "--dry-run":
-        print(f"[DRY-RUN] {cmd}")
+        print(f"[DRY-RUN] {cmd if shell else ' '.join(cmd)}")
+        return
+    subprocess.run(cmd, shell=shell, check=True)
+    # Any change to the system may invalidate earlier probe results
+    _PROBE_CACHE.clear()
+
+# ---------------- SYSTEMD ----------------
+@functools.lru_cache(maxsize=1)
+def system_bus():
+    """One system-bus connection, shared by all unit operations."""
+    return dbus.SystemBus()
+
+def systemd_interface(path, interface):
+    return dbus.Interface(
+        system_bus().get_object("org.freedesktop.systemd1", path),
+        interface
+    )
+
+def restart_unit(unit):
+    """Restarts a unit over D-Bus, or via systemctl when dbus is unavailable."""
+    if dbus is None or MODE == "--dry-run":
+        run(f"systemctl restart {unit}")
         return
-    subprocess.run(cmd, shell=True, check=True)
+    try:
+        manager = systemd_interface(
+            "/org/freedesktop/systemd1", "org.freedesktop.systemd1.Manager"
+        )
+        job = manager.RestartUnit(unit, "replace")
+    except dbus.exceptions.DBusException:
+        run(f"systemctl restart {unit}")
+        return
+
+    # Like systemctl, block until the restart job has finished
+    while any(j[4] == job for j in manager.ListJobs()):
+        time.sleep(0.1)
+    _PROBE_CACHE.clear()
 
-def exists(cmd):
-    return subprocess.run(
-        cmd, shell=True,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
-    ).returncode == 0
+    unit_props = systemd_interface(
+        manager.GetUnit(unit), "org.freedesktop.DBus.Properties"
+    )
+    state = unit_props.Get("org.freedesktop.systemd1.Unit", "ActiveState")
+    if state != "active":
+        raise RuntimeError(f"{unit} failed to restart (state: {state})")
+
+# Probe results keyed by argv tuple, so audit reruns don't fork again
+_PROBE_CACHE = {}
+
+def probe(argv):
+    """Runs a read-only command (no shell) and returns (returncode, stdout)."""
+    key = tuple(argv)
+    if key not in _PROBE_CACHE:
+        try:
+            result = subprocess.run(
+                argv,
+                capture_output=True,
+                text=True
+            )
+            _PROBE_CACHE[key] = (result.returncode, result.stdout)
+        except FileNotFoundError:
+            _PROBE_CACHE[key] = (127, "")
+    return _PROBE_CACHE[key]
+
+def exists(argv):
+    return probe(argv)[0] == 0
+
+def root_locked():
+    # `passwd -S root` -> "root L 01/01/2024 0 99999 7 -1"
+    return probe(["passwd", "-S", "root"])[1].split()[1:2] == ["L"]
+
+def firewall_active():
+    return "Status: active" in probe(["ufw", "status"])[1]
+
+def missing_ufw_rules(ports):
+    # `ufw show added` lists rules as "ufw allow 22", even while inactive
+    added = set(probe(["ufw", "show", "added"])[1].splitlines())
+    return [p for p in ports if f"ufw allow {p}" not in added]
+
+# File contents keyed by path -> (mtime_ns, contents), re-read only on change
+_FILE_CACHE = {}
+
+def read_cached(path):
+    """Returns file contents, re-reading only if the mtime changed."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    cached = _FILE_CACHE.get(path)
+    if cached is None or cached[0] != mtime_ns:
+        with open(path, 'r') as f:
+            cached = (mtime_ns, f.read())
+        _FILE_CACHE[path] = cached
+    return cached[1]
 
 def file_contains(path, text):
     """Checks if a file contains a specific string."""
-    if not os.path.exists(path):
-        return False
     try:
-        with open(path, 'r') as f:
-            return text in f.read()
+        return text in read_cached(path)
     except Exception:
         return False
 
@@ -74,42 +166,79 @@ def append_if_missing(path, text):
         else:
             with open(path, "a") as f:
                 f.write(text + "\n")
+            # Keep the cache hot instead of re-reading the whole file
+            contents = _FILE_CACHE.get(path, (0, ""))[1] + text + "\n"
+            _FILE_CACHE[path] = (os.stat(path).st_mtime_ns, contents)
             print(f"✔ Appended configuration to {path}")
 
+def apt_cache_fresh():
+    """True if apt package lists were refreshed within APT_CACHE_MAX_AGE."""
+    try:
+        return time.time() - os.stat(APT_PKGCACHE).st_mtime < APT_CACHE_MAX_AGE
+    except OSError:
+        return False
+
+# A stanza's Package line followed (within the stanza) by an installed Status
+DPKG_INSTALLED = re.compile(
+    rb"^Package: (\S+)\n(?:[^\n]+\n)*?Status: install ok installed$", re.M
+)
+
+def missing_packages(packages):
+    """Scans the dpkg status DB once instead of forking dpkg-query per package."""
+    try:
+        with open(DPKG_STATUS, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                installed = {m[1].decode() for m in DPKG_INSTALLED.finditer(buf)}
+    except (OSError, ValueError):
+        return list(packages)
+    return [p for p in packages if p not in installed]
+
+# Opened once in main(); closed (and flushed) at exit
+_REPORT = None
+
+def open_report(title):
+    global _REPORT
+    _REPORT = open(REPORT_FILE, "w", buffering=8192)
+    atexit.register(_REPORT.close)
+    _REPORT.write(f"{title} - {datetime.now()}\n")
+
 def report(line):
     print(line)
-    with open(REPORT_FILE, "a") as f:
-        f.write(line + "\n")
+    _REPORT.write(line + "\n")
 
 def header(title):
     report(f"\n=== {title} ===")
 
 # ---------------- AUDIT ----------------
-def audit():
+def audit(facts=None):
+    """Reports compliance; checks already established by apply() are not re-probed."""
+    facts = facts or {}
     header("AUDIT RESULTS")
 
-    checks = {
-        "Docker user exists":
-            exists(f"id {DOCKER_USER}"),
-        "Docker group exists":
-            exists(f"getent group {DOCKER_GROUP}"),
-        "Remap user (dockremap) exists":
-            exists(f"id {DOCKER_REMAP_USER}"),
-        "Subuid configured":
-            file_contains("/etc/subuid", f"{DOCKER_REMAP_USER}:100000:65536"),
-        "Subgid configured":
-            file_contains("/etc/subgid", f"{DOCKER_REMAP_USER}:100000:65536"),
-        "Root login disabled":
-            exists("passwd -S root | grep L"),
-        "Firewall enabled":
-            exists("ufw status | grep -q active"),
-        "Fail2ban running":
-            exists("systemctl is-active fail2ban"),
-        "Auto updates enabled":
-            exists("systemctl is-enabled unattended-upgrades"),
-    }
+    remap_config = f"{DOCKER_REMAP_USER}:100000:65536"
+    checks = [
+        ("docker_user", "Docker user exists",
+            lambda: exists(["id", DOCKER_USER])),
+        ("docker_group", "Docker group exists",
+            lambda: exists(["getent", "group", DOCKER_GROUP])),
+        ("remap_user", "Remap user (dockremap) exists",
+            lambda: exists(["id", DOCKER_REMAP_USER])),
+        ("subuid_ok", "Subuid configured",
+            lambda: file_contains("/etc/subuid", remap_config)),
+        ("subgid_ok", "Subgid configured",
+            lambda: file_contains("/etc/subgid", remap_config)),
+        ("root_locked", "Root login disabled",
+            root_locked),
+        ("firewall", "Firewall enabled",
+            firewall_active),
+        ("fail2ban", "Fail2ban running",
+            lambda: exists(["systemctl", "is-active", "fail2ban"])),
+        ("auto_updates", "Auto updates enabled",
+            lambda: exists(["systemctl", "is-enabled", "unattended-upgrades"])),
+    ]
 
-    for item, ok in checks.items():
+    for key, item, check in checks:
+        ok = facts[key] if key in facts else check()
         report(f"[{'PASS' if ok else 'FAIL'}] {item}")
 
 # ---------------- APPLY ----------------
@@ -127,7 +256,7 @@ def apply():
 
     # 2. Namespace Remapping User (dockremap)
     # Necessary for "userns-remap": "default" in daemon.json
-    if not exists(f"id {DOCKER_REMAP_USER}"):
+    if not exists(["id", DOCKER_REMAP_USER]):
         run(f"adduser --system --no-create-home --group {DOCKER_REMAP_USER}")
         print(f"✔ Created system user: {DOCKER_REMAP_USER}")
     
@@ -150,16 +279,25 @@ def apply():
     run("passwd -l root") # Lock root account
 
     # Firewall & Tools
-    run("apt update && apt install -y ufw fail2ban unattended-upgrades rsyslog logrotate")
+    missing = missing_packages(PACKAGES)
+    if missing:
+        if not apt_cache_fresh():
+            run(["apt-get", "update", "-qq"])
+        run([
+            "apt-get", "install", "-y", "--no-install-recommends",
+            "-o", "Dpkg::Use-Pty=0", *missing
+        ])
+    else:
+        print("✔ Packages already installed, skipping apt")
     
     # UFW Configuration
     run("ufw default deny incoming")
     run("ufw default allow outgoing")
-    for p in ALLOWED_PORTS:
-        run(f"ufw allow {p}")
+    for p in missing_ufw_rules(ALLOWED_PORTS):
+        run(["ufw", "allow", p])
     
     # Only enable if not already active to avoid disrupting connection
-    if not exists("ufw status | grep -q active"):
+    if not firewall_active():
         run("ufw --force enable")
 
     # Fail2ban
@@ -168,24 +306,37 @@ def apply():
     # Logs Persistence
     journald = "/etc/systemd/journald.conf"
     append_if_missing(journald, "Storage=persistent")
-    run("systemctl restart systemd-journald")
+    restart_unit("systemd-journald.service")
 
     report("✔ APPLY COMPLETE")
 
+    # Facts guaranteed by the (check=True) commands above; nothing is
+    # established in dry-run mode, so audit() probes everything there.
+    if MODE == "--dry-run":
+        return {}
+    return {
+        "docker_user": True,
+        "docker_group": True,
+        "remap_user": True,
+        "subuid_ok": True,
+        "subgid_ok": True,
+        "root_locked": True,
+        "firewall": True,
+    }
+
 # ---------------- MAIN ----------------
 def main():
     if MODE not in ["--apply", "--check", "--dry-run"]:
         print("Usage: script.py [--apply | --check | --dry-run]")
         sys.exit(1)
 
-    with open(REPORT_FILE, "w") as f:
-        f.write(f"Compliance Report - {datetime.now()}\n")
+    open_report("Compliance Report")
 
     if MODE == "--check":
         audit()
     else:
-        apply()
-        audit()
+        facts = apply()
+        audit(facts)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
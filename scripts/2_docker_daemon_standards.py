@@ -38,12 +38,25 @@ WARNING
 """
 
 import os
+import atexit
 import sys
 import json
+import functools
+import time
 import subprocess
 from pathlib import Path
 from datetime import datetime
 
+try:
+    import dbus  # Optional: talk to systemd without forking systemctl
+except ImportError:
+    dbus = None
+
+try:
+    import ijson  # Optional: streams large `docker inspect` output
+except ImportError:
+    ijson = None
+
 # ---------------- CONFIG ----------------
 DAEMON_JSON = "/etc/docker/daemon.json"
 REPORT_FILE = "/var/log/docker-daemon-compliance.txt"
@@ -72,29 +85,155 @@ def run(cmd):
         print(f"[DRY-RUN] {cmd}")
         return
     subprocess.run(cmd, shell=True, check=True)
+    # A daemon restart invalidates the cached container list
+    get_running_containers.cache_clear()
+
+# ---------------- SYSTEMD ----------------
+@functools.lru_cache(maxsize=1)
+def system_bus():
+    """One system-bus connection, shared by all unit operations."""
+    return dbus.SystemBus()
+
+def systemd_interface(path, interface):
+    return dbus.Interface(
+        system_bus().get_object("org.freedesktop.systemd1", path),
+        interface
+    )
+
+def restart_unit(unit):
+    """Restarts a unit over D-Bus, or via systemctl when dbus is unavailable."""
+    if dbus is None or MODE == "--dry-run":
+        run(f"systemctl restart {unit}")
+        return
+    try:
+        manager = systemd_interface(
+            "/org/freedesktop/systemd1", "org.freedesktop.systemd1.Manager"
+        )
+        job = manager.RestartUnit(unit, "replace")
+    except dbus.exceptions.DBusException:
+        run(f"systemctl restart {unit}")
+        return
 
-def exists(cmd):
-    return subprocess.run(
-        cmd,
-        shell=True,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
-    ).returncode == 0
+    # Like systemctl, block until the restart job has finished
+    while any(j[4] == job for j in manager.ListJobs()):
+        time.sleep(0.1)
+    get_running_containers.cache_clear()
+
+    unit_props = systemd_interface(
+        manager.GetUnit(unit), "org.freedesktop.DBus.Properties"
+    )
+    state = unit_props.Get("org.freedesktop.systemd1.Unit", "ActiveState")
+    if state != "active":
+        raise RuntimeError(f"{unit} failed to restart (state: {state})")
+
+# Opened once in main(); closed (and flushed) at exit
+_REPORT = None
+
+def open_report(title):
+    global _REPORT
+    _REPORT = open(REPORT_FILE, "w", buffering=8192)
+    atexit.register(_REPORT.close)
+    _REPORT.write(f"{title} - {datetime.now()}\n")
 
 def report(line):
     print(line)
-    with open(REPORT_FILE, "a") as f:
-        f.write(line + "\n")
+    _REPORT.write(line + "\n")
 
 def header(title):
     report(f"\n=== {title} ===")
 
+# ---------------- CONTAINER HELPERS ----------------
+# Full container IDs are 64 chars; this keeps argv well under ARG_MAX
+INSPECT_BATCH = 500
+
+@functools.lru_cache(maxsize=1)
+def get_running_containers():
+    """Full IDs of running containers, or None if docker is not usable."""
+    try:
+        result = subprocess.run(
+            ["docker", "ps", "-q", "--no-trunc", "--filter", "status=running"],
+            capture_output=True,
+            text=True
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.splitlines()
+
+def inspect_containers(containers):
+    """Yields inspect data with one docker call per batch.
+
+    With ijson installed, each container is parsed as docker streams it, so
+    only one container's data is held in memory at a time.
+    """
+    for i in range(0, len(containers), INSPECT_BATCH):
+        proc = subprocess.Popen(
+            ["docker", "inspect"] + containers[i:i + INSPECT_BATCH],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            if ijson is not None:
+                try:
+                    yield from ijson.items(proc.stdout, "item")
+                except ijson.IncompleteJSONError:
+                    # Empty output: every container exited before inspect
+                    pass
+            else:
+                output = proc.stdout.read()
+                if output.strip():
+                    yield from json.loads(output)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
 # ---------------- DAEMON HELPERS ----------------
+@functools.lru_cache(maxsize=1)
+def _read_daemon_config(path, mtime_ns):
+    # mtime_ns is unused here; it keys the cache so a rewritten file is re-parsed
+    with open(path) as f:
+        return json.load(f)
+
 def load_current_daemon_config():
-    if Path(DAEMON_JSON).exists():
-        with open(DAEMON_JSON) as f:
-            return json.load(f)
-    return {}
+    try:
+        mtime_ns = os.stat(DAEMON_JSON).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    return _read_daemon_config(DAEMON_JSON, mtime_ns)
+
+def write_daemon_config(payload):
+    """Atomically replaces daemon.json so dockerd never sees a partial file."""
+    tmp = DAEMON_JSON + ".tmp"
+    try:
+        old = os.stat(DAEMON_JSON)
+    except FileNotFoundError:
+        old = None
+
+    try:
+        with open(tmp, "wb") as f:
+            # Keep the existing file's mode and owner across the replace
+            if old is not None:
+                os.fchmod(f.fileno(), old.st_mode & 0o7777)
+                os.fchown(f.fileno(), old.st_uid, old.st_gid)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, DAEMON_JSON)
+    except BaseException:
+        # Never leave a stale temp file behind in /etc/docker
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    # Persist the rename itself
+    dir_fd = os.open(os.path.dirname(DAEMON_JSON), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    _read_daemon_config.cache_clear()
 
 def daemon_config_compliant(current):
     for key, value in DESIRED_DAEMON_CONFIG.items():
@@ -104,6 +243,7 @@ def daemon_config_compliant(current):
 
 # ---------------- APPLY ----------------
 def apply_daemon_config():
+    """Enforces daemon.json and returns the facts audit can skip re-probing."""
     header("APPLYING DOCKER DAEMON CONFIGURATION")
 
     Path("/etc/docker").mkdir(exist_ok=True)
@@ -112,21 +252,30 @@ def apply_daemon_config():
     updated = current.copy()
     updated.update(DESIRED_DAEMON_CONFIG)
 
+    # Dict equality ignores key order and formatting, so only a real
+    # change triggers the rewrite and dockerd restart
     if current != updated:
         report("[INFO] Docker daemon configuration requires update")
         if MODE != "--dry-run":
-            with open(DAEMON_JSON, "w") as f:
-                json.dump(updated, f, indent=2)
-        run("systemctl restart docker")
+            payload = json.dumps(updated, indent=2, sort_keys=True) + "\n"
+            write_daemon_config(payload.encode())
+        restart_unit("docker.service")
         report("[OK] Docker daemon configuration applied")
     else:
         report("[OK] Docker daemon configuration already compliant")
 
+    if MODE == "--dry-run":
+        return {}
+    return {"daemon_config": updated}
+
 # ---------------- AUDIT ----------------
-def audit_daemon_config():
+def audit_daemon_config(facts=None):
     header("DAEMON CONFIGURATION AUDIT")
 
-    current = load_current_daemon_config()
+    facts = facts or {}
+    current = facts.get("daemon_config")
+    if current is None:
+        current = load_current_daemon_config()
     for key, value in DESIRED_DAEMON_CONFIG.items():
         status = "PASS" if current.get(key) == value else "FAIL"
         report(f"[{status}] {key}")
@@ -134,30 +283,16 @@ def audit_daemon_config():
 def audit_running_containers():
     header("RUNNING CONTAINER AUDIT")
 
-    if not exists("docker ps"):
+    containers = get_running_containers()
+    if containers is None:
         report("[WARN] Docker not running or not accessible")
         return
 
-    result = subprocess.run(
-        "docker ps -q",
-        shell=True,
-        capture_output=True,
-        text=True
-    )
-
-    containers = result.stdout.splitlines()
     if not containers:
         report("[OK] No running containers detected")
         return
 
-    for cid in containers:
-        inspect = subprocess.run(
-            f"docker inspect {cid}",
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-        data = json.loads(inspect.stdout)[0]
+    for data in inspect_containers(containers):
         name = data["Name"].lstrip("/")
 
         if data["HostConfig"].get("Privileged"):
@@ -171,7 +306,7 @@ def audit_running_containers():
 def audit_root_docker_access():
     header("ROOT DOCKER ACCESS AUDIT")
 
-    if exists("docker ps"):
+    if get_running_containers() is not None:
         report("[WARN] Docker CLI usable as root")
         report("       Recommendation: restrict docker.sock via group")
     else:
@@ -185,13 +320,13 @@ def main():
 
     require_root()
 
-    with open(REPORT_FILE, "w") as f:
-        f.write(f"Docker Daemon Compliance Report - {datetime.now()}\n")
+    open_report("Docker Daemon Compliance Report")
 
+    facts = {}
     if MODE == "--apply":
-        apply_daemon_config()
+        facts = apply_daemon_config()
 
-    audit_daemon_config()
+    audit_daemon_config(facts)
     audit_running_containers()
     audit_root_docker_access()
 
@@ -33,11 +33,18 @@ SAFETY
 """
 
 import os
+import atexit
 import sys
 import subprocess
 import json
+import functools
 from datetime import datetime
 
+try:
+    import ijson  # Optional: streams large `docker inspect` output
+except ImportError:
+    ijson = None
+
 # ---------------- CONFIG ----------------
 MODE = "--apply" if len(sys.argv) == 1 else sys.argv[1]
 REPORT_FILE = "/var/log/docker-network-compliance.txt"
@@ -67,36 +74,90 @@ def run(cmd):
     if MODE == "--dry-run":
         print(f"[DRY-RUN] {cmd}")
         return ""
-    return subprocess.run(cmd, shell=True, capture_output=True, text=True).stdout
+    output = subprocess.run(cmd, shell=True, capture_output=True, text=True).stdout
+    # Any change to the system may invalidate earlier inspect results
+    _NETWORK_CACHE.clear()
+    return output
+
+# Opened once in main(); closed (and flushed) at exit
+_REPORT = None
 
-def exists(cmd):
-    return subprocess.run(
-        cmd,
-        shell=True,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
-    ).returncode == 0
+def open_report(title):
+    global _REPORT
+    _REPORT = open(REPORT_FILE, "w", buffering=8192)
+    atexit.register(_REPORT.close)
+    _REPORT.write(f"{title} - {datetime.now()}\n")
 
 def report(line):
     print(line)
-    with open(REPORT_FILE, "a") as f:
-        f.write(line + "\n")
+    _REPORT.write(line + "\n")
 
 def header(title):
     report(f"\n=== {title} ===")
 
+# ---------------- CONTAINER HELPERS ----------------
+# Full container IDs are 64 chars; this keeps argv well under ARG_MAX
+INSPECT_BATCH = 500
+
+@functools.lru_cache(maxsize=1)
+def get_running_containers():
+    """Full IDs of running containers, or None if docker is not usable."""
+    try:
+        result = subprocess.run(
+            ["docker", "ps", "-q", "--no-trunc", "--filter", "status=running"],
+            capture_output=True,
+            text=True
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.splitlines()
+
+def inspect_containers(containers):
+    """Yields inspect data with one docker call per batch.
+
+    With ijson installed, each container is parsed as docker streams it, so
+    only one container's data is held in memory at a time.
+    """
+    for i in range(0, len(containers), INSPECT_BATCH):
+        proc = subprocess.Popen(
+            ["docker", "inspect"] + containers[i:i + INSPECT_BATCH],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            if ijson is not None:
+                try:
+                    yield from ijson.items(proc.stdout, "item")
+                except ijson.IncompleteJSONError:
+                    # Empty output: every container exited before inspect
+                    pass
+            else:
+                output = proc.stdout.read()
+                if output.strip():
+                    yield from json.loads(output)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
 # ---------------- NETWORK HELPERS ----------------
-def network_exists(name):
-    return exists(f"docker network inspect {name}")
+# Inspect results keyed by network name (None = missing), filled lazily
+_NETWORK_CACHE = {}
 
 def inspect_network(name):
-    output = subprocess.run(
-        f"docker network inspect {name}",
-        shell=True,
-        capture_output=True,
-        text=True
-    ).stdout
-    return json.loads(output)[0]
+    if name not in _NETWORK_CACHE:
+        result = subprocess.run(
+            ["docker", "network", "inspect", name],
+            capture_output=True,
+            text=True
+        )
+        data = json.loads(result.stdout or "[]") if result.returncode == 0 else []
+        _NETWORK_CACHE[name] = data[0] if data else None
+    return _NETWORK_CACHE[name]
+
+def network_exists(name):
+    return inspect_network(name) is not None
 
 # ---------------- APPLY ----------------
 def apply_networks():
@@ -112,6 +173,10 @@ def apply_networks():
             report(f"[OK] Network exists: {name}")
 
         data = inspect_network(name)
+        if data is None:
+            # run() ignores the exit code, so a failed create lands here
+            report(f"[FAIL] Network missing after create: {name}")
+            continue
         actual_internal = data.get("Internal")
 
         if actual_internal == cfg["internal"]:
@@ -123,26 +188,16 @@ def apply_networks():
 def audit_container_networks():
     header("CONTAINER NETWORK AUDIT")
 
-    result = subprocess.run(
-        "docker ps -q",
-        shell=True,
-        capture_output=True,
-        text=True
-    )
+    containers = get_running_containers()
+    if containers is None:
+        report("[WARN] Docker not running or not accessible")
+        return
 
-    containers = result.stdout.splitlines()
     if not containers:
         report("[OK] No running containers detected")
         return
 
-    for cid in containers:
-        inspect = subprocess.run(
-            f"docker inspect {cid}",
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-        data = json.loads(inspect.stdout)[0]
+    for data in inspect_containers(containers):
         name = data["Name"].lstrip("/")
         networks = list(data["NetworkSettings"]["Networks"].keys())
 
@@ -167,8 +222,7 @@ def main():
 
     require_root()
 
-    with open(REPORT_FILE, "w") as f:
-        f.write(f"Docker Network Compliance Report - {datetime.now()}\n")
+    open_report("Docker Network Compliance Report")
 
     if MODE == "--apply":
         apply_networks()
@@ -7,10 +7,18 @@ Reads configuration from a local .env file.
 """
 
 import os
+import re
 import sys
+import pwd
+import grp
+import mmap
+import subprocess
 from pathlib import Path
 
 # ---------------- CONFIG LOADER ----------------
+# KEY=VALUE lines; comments and blank lines never match
+ENV_LINE = re.compile(rb"^[ \t]*([^#=\s][^=\n]*)=(.*)$", re.M)
+
 def load_env(env_path):
     config = {}
     if not os.path.exists(env_path):
@@ -19,16 +27,23 @@ def load_env(env_path):
         sys.exit(1)
     
     print(f"Loading config from {env_path}...")
-    with open(env_path, "r") as f:
-        for line in f:
-            # Skip comments and empty lines
-            if line.strip().startswith("#") or not line.strip():
-                continue
-            if "=" in line:
-                key, value = line.strip().split("=", 1)
-                config[key.strip()] = value.strip()
+    with open(env_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return config
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for m in ENV_LINE.finditer(buf):
+                config[m[1].decode().strip()] = m[2].decode().strip()
     return config
 
+def resolve_id(value, lookup):
+    """Numeric id or user/group name, as `chown -R PUID:PGID` accepted."""
+    if value.isdigit():
+        return int(value)
+    try:
+        return lookup(value)
+    except KeyError:
+        return None
+
 # ---------------- SETUP ----------------
 ENV_FILE = Path(__file__).parent / "../.env"
 CONFIG = load_env(ENV_FILE)
@@ -42,6 +57,13 @@ except KeyError as e:
     print(f"❌ Error: Missing {e} in .env file.")
     sys.exit(1)
 
+UID = resolve_id(PUID, lambda name: pwd.getpwnam(name).pw_uid)
+GID = resolve_id(PGID, lambda name: grp.getgrnam(name).gr_gid)
+if UID is None or GID is None:
+    unknown = f"user '{PUID}'" if UID is None else f"group '{PGID}'"
+    print(f"❌ Error: Unknown {unknown} in .env file.")
+    sys.exit(1)
+
 STRUCTURE = [
     "apps",
     "secrets",
@@ -54,9 +76,41 @@ STRUCTURE = [
 ]
 
 # ---------------- EXECUTION ----------------
-def run(cmd):
-    # print(f"[EXEC] {cmd}") # Uncomment for verbose debug
-    os.system(cmd)
+def run(argv):
+    # print(f"[EXEC] {argv}") # Uncomment for verbose debug
+    subprocess.run(argv, check=True)
+
+def missing_folders(root, folders):
+    """Returns the folders not yet present, listing each parent dir only once."""
+    listings = {}
+    missing = []
+    for folder in folders:
+        parent, _, name = folder.rpartition("/")
+        if parent not in listings:
+            try:
+                with os.scandir(root / parent) as entries:
+                    listings[parent] = {e.name for e in entries if e.is_dir()}
+            except FileNotFoundError:
+                listings[parent] = set()
+        if name not in listings[parent]:
+            missing.append(folder)
+    return missing
+
+def enforce_permissions(top, uid, gid):
+    """Sets owner on everything and standard modes outside secrets in one walk."""
+    secrets_dir = os.path.join(top, "secrets")
+    for root, dirs, files in os.walk(top):
+        # The top-level secrets dir is made root-only right after this walk
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != secrets_dir]
+        os.chown(root, uid, gid)
+        # Modes keep the old `find -not -path '*/secrets*'` exclusion
+        if "/secrets" not in root:
+            os.chmod(root, 0o775)
+        for name in files:
+            path = os.path.join(root, name)
+            os.chown(path, uid, gid, follow_symlinks=False)
+            if "/secrets" not in path and not os.path.islink(path):
+                os.chmod(path, 0o664)
 
 def apply():
     if os.geteuid() != 0:
@@ -76,10 +130,13 @@ def apply():
             sys.exit(1)
 
     # 2. Create Subdirectories
+    missing = missing_folders(SERVER_ROOT, STRUCTURE)
     for folder in STRUCTURE:
-        path = SERVER_ROOT / folder
-        path.mkdir(parents=True, exist_ok=True)
-        print(f"✔ Verified/Created: {folder}")
+        if folder in missing:
+            (SERVER_ROOT / folder).mkdir(parents=True, exist_ok=True)
+            print(f"✔ Created: {folder}")
+        else:
+            print(f"✔ Verified: {folder}")
 
     # 3. Create Placeholder Files
     (SERVER_ROOT / "compose.yaml").touch()
@@ -89,18 +146,15 @@ def apply():
     print("\n=== Enforcing Permissions ===")
     
     # Set global ownership to PUID:PGID
-    run(f"chown -R {PUID}:{PGID} {SERVER_ROOT}")
+    # Standard Directory Permissions (775 allows group write, good for automation)
+    # We exclude secrets dir from this bulk change
+    enforce_permissions(SERVER_ROOT, UID, GID)
     
     # Standard 6.1: Secrets must be strict (Root owned)
     secrets_dir = SERVER_ROOT / "secrets"
-    run(f"chown -R root:root {secrets_dir}")
-    run(f"chmod -R 700 {secrets_dir}")
+    run(["chown", "-R", "root:root", str(secrets_dir)])
+    run(["chmod", "-R", "700", str(secrets_dir)])
     print(f"✔ Secured: {secrets_dir} (Root only)")
-
-    # Standard Directory Permissions (775 allows group write, good for automation)
-    # We exclude secrets dir from this bulk change
-    run(f"find {SERVER_ROOT} -type d -not -path '*/secrets*' -exec chmod 775 {{}} +")
-    run(f"find {SERVER_ROOT} -type f -not -path '*/secrets*' -exec chmod 664 {{}} +")
     
     print("\n🎉 Folder Structure Enforced based on .env configuration.")
 
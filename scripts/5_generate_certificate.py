@@ -3,11 +3,24 @@
 import os
 import sys
 import shutil
+import functools
 import subprocess
-import platform
 from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+try:
+    # Optional: generate key + certificate in-process, no openssl needed
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+except ImportError:
+    x509 = None
 
 DAYS = 825
+RENEW_BEFORE_DAYS = 30
+# sys.platform is fixed at build time, no platform module import needed
+SYSTEM = sys.platform
 
 
 # ======================================================
@@ -27,13 +40,15 @@ def fail(msg):
 # Helpers
 # ======================================================
 
+@functools.lru_cache(maxsize=None)
 def exists(cmd):
+    # One PATH walk per tool; callers only probe package managers
     return shutil.which(cmd) is not None
 
 
-def run(cmd, shell=False, check=True):
+def run(cmd, shell=False, check=True, input=None):
     try:
-        subprocess.run(cmd, shell=shell, check=check)
+        subprocess.run(cmd, shell=shell, check=check, input=input)
     except Exception:
         if check:
             fail(f"Command failed: {cmd}")
@@ -49,7 +64,7 @@ def find_openssl():
         return exe
 
     # windows common paths
-    if platform.system() == "Windows":
+    if SYSTEM == "win32":
         paths = [
             r"C:\Program Files\OpenSSL-Win64\bin\openssl.exe",
             r"C:\Program Files (x86)\OpenSSL-Win32\bin\openssl.exe",
@@ -67,14 +82,12 @@ def find_openssl():
 # ======================================================
 
 def install_openssl():
-    system = platform.system()
-
     warn("OpenSSL not found. Attempting install...")
 
     try:
 
         # ---------- Linux ----------
-        if system == "Linux":
+        if SYSTEM == "linux":
 
             if exists("apt"):
                 run(["sudo", "apt", "update"])
@@ -84,13 +97,13 @@ def install_openssl():
                 run(["sudo", "dnf", "install", "-y", "openssl"])
 
         # ---------- macOS ----------
-        elif system == "Darwin":
+        elif SYSTEM == "darwin":
 
             if exists("brew"):
                 run(["brew", "install", "openssl"])
 
         # ---------- Windows ----------
-        elif system == "Windows":
+        elif SYSTEM == "win32":
 
             # IMPORTANT: DO NOT CHECK RETURN CODE
             if exists("winget"):
@@ -117,8 +130,7 @@ def install_openssl():
 # Config
 # ======================================================
 
-def create_config(domain, path):
-    path.write_text(f"""
+CONFIG_TEMPLATE = """
 [req]
 prompt = no
 default_bits = 2048
@@ -135,14 +147,102 @@ subjectAltName = @alt_names
 [alt_names]
 DNS.1 = {domain}
 DNS.2 = *.{domain}
-""")
+"""
+
+
+def create_config(domain, path):
+    config = CONFIG_TEMPLATE.format(domain=domain).encode()
+
+    # Leave an identical config untouched
+    if path.exists() and path.read_bytes() == config:
+        return
+
+    path.write_bytes(config)
 
 
 # ======================================================
 # Generate certificate
 # ======================================================
 
-def generate(domain):
+def cert_still_valid(domain, crt):
+    """True if crt covers domain + *.domain for more than RENEW_BEFORE_DAYS."""
+    wanted = {domain, f"*.{domain}"}
+
+    if x509 is not None:
+        try:
+            cert = x509.load_pem_x509_certificate(crt.read_bytes())
+            names = cert.extensions.get_extension_for_class(
+                x509.SubjectAlternativeName
+            ).value.get_values_for_type(x509.DNSName)
+        except (ValueError, x509.ExtensionNotFound):
+            return False
+        # not_valid_after_utc needs cryptography >= 42
+        expires = getattr(cert, "not_valid_after_utc", None)
+        if expires is None:
+            expires = cert.not_valid_after.replace(tzinfo=timezone.utc)
+        remaining = expires - datetime.now(timezone.utc)
+        return remaining > timedelta(days=RENEW_BEFORE_DAYS) and wanted <= set(names)
+
+    openssl = find_openssl()
+    if not openssl:
+        return False
+    result = subprocess.run(
+        [openssl, "x509", "-in", str(crt), "-noout",
+         "-checkend", str(RENEW_BEFORE_DAYS * 86400), "-ext", "subjectAltName"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        return False
+    # SAN line looks like "    DNS:sid.lab, DNS:*.sid.lab"; compare exact names
+    names = {
+        entry.strip()[len("DNS:"):]
+        for line in result.stdout.splitlines()
+        for entry in line.split(",")
+        if entry.strip().startswith("DNS:")
+    }
+    return wanted <= names
+
+
+def generate_in_process(domain, key, crt):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domain)])
+    now = datetime.now(timezone.utc)
+
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=DAYS))
+        .add_extension(
+            x509.SubjectAlternativeName([
+                x509.DNSName(domain),
+                x509.DNSName(f"*.{domain}"),
+            ]),
+            critical=False,
+        )
+        .add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(private_key.public_key()),
+            critical=False,
+        )
+        .sign(private_key, hashes.SHA256())
+    )
+
+    # Unencrypted PKCS#8, like `openssl req -nodes`; readable by owner only
+    fd = os.open(key, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ))
+    crt.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+
+
+def generate_with_openssl(domain, key, crt, cnf):
 
     openssl = find_openssl()
 
@@ -159,14 +259,14 @@ def generate(domain):
 
     ok(f"Using OpenSSL → {openssl}")
 
-    cert_dir = Path(f"../certificates/{domain}")
-    cert_dir.mkdir(exist_ok=True)
-
-    key = cert_dir / f"{domain}.key"
-    crt = cert_dir / f"{domain}.crt"
-    cnf = cert_dir / f"{domain}.cnf"
-
-    create_config(domain, cnf)
+    # Feed the config through a pipe; Windows has no /dev/stdin, so it
+    # still gets a .cnf file on disk
+    if SYSTEM == "win32":
+        create_config(domain, cnf)
+        config_path, config_input = str(cnf), None
+    else:
+        config_path = "/dev/stdin"
+        config_input = CONFIG_TEMPLATE.format(domain=domain).encode()
 
     info("Generating certificate...")
 
@@ -175,12 +275,37 @@ def generate(domain):
         "req",
         "-x509",
         "-nodes",
+        "-batch",
         "-days", str(DAYS),
         "-newkey", "rsa:2048",
         "-keyout", str(key),
         "-out", str(crt),
-        "-config", str(cnf)
-    ])
+        "-config", config_path
+    ], input=config_input)
+
+
+def generate(domain):
+
+    cert_dir = Path(f"../certificates/{domain}")
+    cert_dir.mkdir(exist_ok=True)
+
+    key = cert_dir / f"{domain}.key"
+    crt = cert_dir / f"{domain}.crt"
+    cnf = cert_dir / f"{domain}.cnf"
+
+    # Skip the RSA keygen when the existing certificate is still good
+    if key.exists() and crt.exists() and cert_still_valid(domain, crt):
+        ok(f"Certificate still valid for more than {RENEW_BEFORE_DAYS} days, skipping")
+        print(f"🔑 {key}")
+        print(f"📜 {crt}")
+        return
+
+    if x509 is not None:
+        ok("Using cryptography (in-process)")
+        info("Generating certificate...")
+        generate_in_process(domain, key, crt)
+    else:
+        generate_with_openssl(domain, key, crt, cnf)
 
     ok("Certificate created successfully!\n")
     print(f"🔑 {key}")